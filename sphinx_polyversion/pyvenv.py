@@ -275,11 +275,17 @@ class Poetry(VirtualPythonEnvironment):
         env = os.environ.copy()
         env.pop("VIRTUAL_ENV", None)  # unset poetry env
         env["POETRY_VIRTUALENVS_IN_PROJECT"] = "False"
+        # reserve a fresh directory for the venvs, creating it atomically
+        # makes sure that environments entered concurrently never share one
         venv_path = self.path / ".venv"
         i = 0
-        while venv_path.exists():
-            venv_path = self.path / f".venv-{i}"
-            i += 1
+        while True:
+            try:
+                venv_path.mkdir()
+                break
+            except FileExistsError:
+                venv_path = self.path / f".venv-{i}"
+                i += 1
         env["POETRY_VIRTUALENVS_PATH"] = str(venv_path)
 
         process = await asyncio.create_subprocess_exec(
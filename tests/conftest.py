@@ -0,0 +1,24 @@
+"""Shared fixtures for the tests."""
+
+import asyncio
+
+import pytest
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+@pytest.fixture(scope="session")
+def event_loop_policy() -> asyncio.AbstractEventLoopPolicy:
+    """Run the async tests on uvloop if it is installed."""
+    if uvloop is None:
+        return asyncio.DefaultEventLoopPolicy()
+    return uvloop.EventLoopPolicy()
+
+
+@pytest.fixture(autouse=True)
+def _no_bytecode(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Keep the python processes spawned by the tests from writing `.pyc` files."""
+    monkeypatch.setenv("PYTHONDONTWRITEBYTECODE", "1")
@@ -2,10 +2,14 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
+import re
+import shlex
+import shutil
 import subprocess
-from datetime import datetime
 from pathlib import Path
+from subprocess import DEVNULL, PIPE, CalledProcessError
 from typing import List, Mapping, Tuple
 
 import pytest
@@ -29,6 +33,27 @@ from sphinx_polyversion.git import (
 NO_FS_MONITOR = ("-c", "core.useBuiltinFSMonitor=false")
 PARTIAL_CLONE = ("-c", "extensions.partialClone=true")
 
+_GIT_PREFIX = ("git", *NO_FS_MONITOR)
+
+
+#: Prefixes of `GIT_` env vars that are passed on by `no_git_env`
+_ALLOWED_GIT_PREFIXES = ("GIT_CONFIG_KEY_", "GIT_CONFIG_VALUE_")
+
+#: `GIT_` env vars that are passed on by `no_git_env`
+_ALLOWED_GIT_VARS = frozenset(
+    {
+        "GIT_EXEC_PATH",
+        "GIT_SSH",
+        "GIT_SSH_COMMAND",
+        "GIT_SSL_CAINFO",
+        "GIT_SSL_NO_VERIFY",
+        "GIT_CONFIG_COUNT",
+        "GIT_HTTP_PROXY_AUTHMETHOD",
+        "GIT_ALLOW_PROTOCOL",
+        "GIT_ASKPASS",
+    }
+)
+
 
 def no_git_env(_env: Mapping[str, str] | None = None) -> dict[str, str]:
     """
@@ -62,110 +87,203 @@ def no_git_env(_env: Mapping[str, str] | None = None) -> dict[str, str]:
         k: v
         for k, v in _env.items()
         if not k.startswith("GIT_")
-        or k.startswith(("GIT_CONFIG_KEY_", "GIT_CONFIG_VALUE_"))
-        or k
-        in {
-            "GIT_EXEC_PATH",
-            "GIT_SSH",
-            "GIT_SSH_COMMAND",
-            "GIT_SSL_CAINFO",
-            "GIT_SSL_NO_VERIFY",
-            "GIT_CONFIG_COUNT",
-            "GIT_HTTP_PROXY_AUTHMETHOD",
-            "GIT_ALLOW_PROTOCOL",
-            "GIT_ASKPASS",
-        }
+        or k.startswith(_ALLOWED_GIT_PREFIXES)
+        or k in _ALLOWED_GIT_VARS
     }
 
 
-@pytest.fixture
-def git_testrepo(tmp_path: Path) -> Tuple[Path, List[GitRef]]:
-    """Create a git repository for testing."""
-    git = ("git", *NO_FS_MONITOR)
-    env = no_git_env()
+#: Types of the refs created by `git_testrepo` in the order of `git for-each-ref`
+_EXPECTED_TYPES: Tuple[GitRefType, ...] = (
+    GitRefType.BRANCH,
+    GitRefType.BRANCH,
+    GitRefType.BRANCH,
+    GitRefType.TAG,
+    GitRefType.TAG,
+)
+
+
+#: Files of the first commit in `git_testrepo`
+_INITIAL_TREE: Mapping[str, bytes] = {
+    "test.txt": b"test",
+    "dir1/file1.txt": b"file1",
+    "dir2/file3.txt": b"file3",
+}
+
+#: Files changed by the second commit in `git_testrepo`
+_SECOND_CHANGES: Mapping[str, bytes] = {
+    "test.txt": b"test2",
+    "dir1/file2.txt": b"file2",
+    "dir1/file1.txt": b"file1a",
+    "dir2/file3.txt": b"file3a",
+}
+
+#: Files changed by the third commit in `git_testrepo`
+_THIRD_CHANGES: Mapping[str, bytes] = {
+    "test.txt": b"test3",
+    "dir1/file2.txt": b"file2a",
+    "dir1/file1.txt": b"file1b",
+}
+
 
-    def run_git(*args: str) -> None:
-        subprocess.run(git + args, cwd=tmp_path, env=env, check=False)
+def _write(path: str | os.PathLike[str], data: bytes) -> None:
+    """Write `data` to a file bypassing the text layers of `Path.write_text`."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
 
-    # init repo
-    run_git("init")
-    run_git("config", "user.email", "example@example.com")
-    run_git("config", "user.name", "example")
-    run_git("config", "commit.gpgsign", "false")
-    run_git("config", "init.defaultBranch", "main")
 
-    # create some files and directories to commit
-    tmp_path.joinpath("test.txt").write_text("test")
-    tmp_path.joinpath("dir1").mkdir()
-    tmp_path.joinpath("dir2").mkdir()
-    tmp_path.joinpath("dir1", "file1.txt").write_text("file1")
-    tmp_path.joinpath("dir2", "file3.txt").write_text("file3")
+def _write_files(root: Path, files: Mapping[str, bytes]) -> None:
+    """Write a batch of files given as relative posix paths and contents."""
+    for relpath, data in files.items():
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write(path, data)
 
-    run_git("add", ".")
-    run_git("commit", "-m", "test")
 
-    # create a branch
-    run_git("branch", "dev")
+def _read_refs(repo: Path) -> List[Tuple[str, str]]:
+    """
+    Read the branches and tags of a repository from its `.git` directory.
 
-    # create changes to commit
-    tmp_path.joinpath("test.txt").write_text("test2")
-    tmp_path.joinpath("dir1", "file2.txt").write_text("file2")
-    tmp_path.joinpath("dir1", "file1.txt").write_text("file1a")
-    tmp_path.joinpath("dir2", "file3.txt").write_text("file3a")
+    This is equivalent to `git for-each-ref --format="%(objectname) %(refname)"`
+    restricted to `refs/heads` and `refs/tags`. Both loose and packed refs
+    are read and a loose ref takes precedence over a packed one.
 
-    run_git("add", ".")
-    run_git("commit", "-m", "test2")
+    Returns
+    -------
+    list[tuple[str, str]]
+        The object id and the name of each ref sorted by the name.
 
-    # create a tag
-    run_git("tag", "1.0", "-m", "")
+    """
+    git_dir = repo / ".git"
+    refs = {}
+    packed_refs = git_dir / "packed-refs"
+    if packed_refs.exists():
+        for line in packed_refs.read_text("ascii").splitlines():
+            # skip the header and the peeled object ids of annotated tags
+            if not line or line.startswith(("#", "^")):
+                continue
+            objectname, refname = line.split(" ", 1)
+            refs[refname] = objectname
+    for kind in ("heads", "tags"):
+        kind_dir = git_dir / "refs" / kind
+        if not kind_dir.exists():
+            continue
+        for path in kind_dir.rglob("*"):
+            if path.is_file():
+                refname = path.relative_to(git_dir).as_posix()
+                # object ids are plain ascii hex digits
+                refs[refname] = path.read_bytes().strip().decode("ascii")
+    return [
+        (objectname, refname)
+        for refname, objectname in sorted(refs.items())
+        if refname.startswith(("refs/heads/", "refs/tags/"))
+    ]
 
-    # commit some more changes
-    tmp_path.joinpath("test.txt").write_text("test3")
-    tmp_path.joinpath("dir1", "file2.txt").write_text("file2a")
-    tmp_path.joinpath("dir1", "file1.txt").write_text("file1b")
 
-    run_git("add", ".")
-    run_git("commit", "-m", "test3")
+def _git_sh(*args: str) -> str:
+    """Quote a git command for use in a shell script."""
+    return shlex.join(_GIT_PREFIX + args)
 
-    # create another branch
-    run_git("branch", "feature")
 
-    # tag the latest commit
-    run_git("tag", "2.0", "-m", "")
+@pytest.fixture(scope="session")
+def git_testrepo_template(
+    tmp_path_factory: pytest.TempPathFactory,
+) -> Tuple[Path, List[GitRef]]:
+    """Create a git repository for testing once per session."""
+    tmp_path = tmp_path_factory.mktemp("git_testrepo")
+    env = no_git_env()
 
-    p = subprocess.run(
-        ["git", "for-each-ref", "--format=%(objectname) %(refname)"],
-        cwd=tmp_path,
-        stdout=subprocess.PIPE,
-        check=False,
+    def run(cmd: Tuple[str, ...]) -> None:
+        # only stderr is needed, for reporting failures
+        p = subprocess.run(
+            cmd,
+            cwd=tmp_path,
+            env=env,
+            stdout=DEVNULL,
+            stderr=PIPE,
+            check=False,
+        )
+        if p.returncode:
+            raise CalledProcessError(p.returncode, cmd, stderr=p.stderr)
+
+    def run_git_batch(*cmds: str) -> None:
+        # run several shell commands in a single shell process
+        run(("bash", "-c", " && ".join(cmds)))
+
+    def commit(
+        message: str, files: Mapping[str, bytes], *, root: bool = False
+    ) -> Tuple[str, ...]:
+        # write the files in one batch and return the commands that stage
+        # exactly them and commit the resulting tree on top of HEAD
+        # with plumbing commands instead of letting `add` and `commit`
+        # scan the worktree
+        _write_files(tmp_path, files)
+        parents = () if root else ("-p", "HEAD")
+        write_tree = _git_sh("write-tree")
+        commit_tree = _git_sh("commit-tree", "--no-gpg-sign", *parents, "-m", message)
+        return (
+            _git_sh("update-index", "--add", "--", *files),
+            f'{_git_sh("update-ref", "HEAD")} "$({commit_tree} "$({write_tree})")"',
+        )
+
+    # init repo, create some files and directories to commit
+    # and create a branch
+    run_git_batch(
+        _git_sh("init", "--initial-branch=main", "-q"),
+        _git_sh("config", "user.email", "example@example.com"),
+        _git_sh("config", "user.name", "example"),
+        *commit("test", _INITIAL_TREE, root=True),
+        _git_sh("update-ref", "refs/heads/dev", "HEAD"),
     )
 
-    types = [
-        GitRefType.BRANCH,
-        GitRefType.BRANCH,
-        GitRefType.BRANCH,
-        GitRefType.TAG,
-        GitRefType.TAG,
-    ]
-    dates = [
-        datetime(2023, 8, 17, 17, 16, 34),
-        datetime(2023, 8, 26, 19, 45, 9),
-        datetime(2023, 8, 29, 19, 45, 9),
-        datetime(2023, 6, 29, 11, 43, 11),
-        datetime(2023, 8, 29, 19, 45, 9),
-    ]
-    lines = [line.split() for line in p.stdout.decode().splitlines()]
+    # commit changes and create a tag
+    # (annotated tags need a tag object, so `update-ref` won't do)
+    run_git_batch(
+        *commit("test2", _SECOND_CHANGES),
+        _git_sh("tag", "1.0", "-m", ""),
+    )
+
+    # commit some more changes, create another branch
+    # and tag the latest commit
+    run_git_batch(
+        *commit("test3", _THIRD_CHANGES),
+        _git_sh("update-ref", "refs/heads/feature", "HEAD"),
+        _git_sh("tag", "2.0", "-m", ""),
+    )
+
+    refs_read = _read_refs(tmp_path)
+    assert len(refs_read) == len(_EXPECTED_TYPES)
     refs = [
-        GitRef(r.split("/")[-1], h, r, t, d)
-        for t, (h, r), d in zip(types, lines, dates)
+        GitRef(r.rpartition("/")[2], h, r, t, None)
+        for t, (h, r) in zip(_EXPECTED_TYPES, refs_read)
     ]
     return tmp_path, refs
 
 
+@pytest.fixture
+def git_testrepo(
+    tmp_path: Path, git_testrepo_template: Tuple[Path, List[GitRef]]
+) -> Tuple[Path, List[GitRef]]:
+    """Provide a private copy of the git repository for testing."""
+    template, refs = git_testrepo_template
+    repo = tmp_path / "repo"
+    shutil.copytree(template, repo, symlinks=True)
+    return repo, list(refs)
+
+
+#: Keyword arguments for `Git` instances matching every branch and tag
+_GIT_KW: Mapping[str, re.Pattern[str]] = {
+    "branch_regex": re.compile(".*"),
+    "tag_regex": re.compile(".*"),
+}
+
+
 @pytest.fixture
 def git() -> Git:
     """Create a `Git` instance for testing."""
-    return Git(branch_regex=".*", tag_regex=".*")
+    return Git(**_GIT_KW)
 
 
 @pytest.fixture
@@ -176,19 +294,11 @@ def git_with_predicate() -> Git:
         return ref.name in ["test", "feature", "1.0"]
 
     return Git(
-        branch_regex=".*",
-        tag_regex=".*",
+        **_GIT_KW,
         predicate=predicate,
     )
 
 
-@pytest.fixture
-def git_with_buffer_size() -> Git:
-    """Create a `Git` instance with a buffer size for testing."""
-    return Git(branch_regex=".*", tag_regex=".*", buffer_size=1024)
-
-
-@pytest.mark.asyncio
 async def test_aroot(git: Git, git_testrepo: Tuple[Path, List[GitRef]]):
     """Test the `aroot` method."""
     repo_path, _ = git_testrepo
@@ -199,7 +309,14 @@ async def test_aroot(git: Git, git_testrepo: Tuple[Path, List[GitRef]]):
     assert root == repo_path
 
 
-@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "git",
+    [
+        Git(**_GIT_KW),
+        Git(**_GIT_KW, buffer_size=1024),
+    ],
+    ids=["default", "buf1024"],
+)
 async def test_checkout(
     git: Git,
     git_testrepo: Tuple[Path, List[GitRef]],
@@ -211,19 +328,6 @@ async def test_checkout(
     assert (tmp_path / "test.txt").read_text() == "test"
 
 
-@pytest.mark.asyncio
-async def test_checkout_with_buffer(
-    git_with_buffer_size: Git,
-    git_testrepo: Tuple[Path, List[GitRef]],
-    tmp_path: Path,
-):
-    """Test the `checkout` method."""
-    repo_path, refs = git_testrepo
-    await git_with_buffer_size.checkout(repo_path, tmp_path, refs[0])
-    assert (tmp_path / "test.txt").read_text() == "test"
-
-
-@pytest.mark.asyncio
 async def test_predicate(git_with_predicate: Git):
     """Test the `predicate` method."""
     root = "."
@@ -248,7 +352,6 @@ def compare_refs(ref1: GitRef, ref2: GitRef) -> bool:
     )
 
 
-@pytest.mark.asyncio
 async def test_retrieve(git: Git, git_testrepo: Tuple[Path, List[GitRef]]):
     """Test the `retrieve` method."""
     root, git_refs = git_testrepo
@@ -259,7 +362,6 @@ async def test_retrieve(git: Git, git_testrepo: Tuple[Path, List[GitRef]]):
         assert compare_refs(ref1, ref2)
 
 
-@pytest.mark.asyncio
 async def test_retrieve_with_predicate(
     git_with_predicate: Git, git_testrepo: Tuple[Path, List[GitRef]]
 ):
@@ -271,55 +373,59 @@ async def test_retrieve_with_predicate(
     assert compare_refs(refs[1], git_refs[3])
 
 
-@pytest.mark.asyncio
 async def test_closest_tag(git_testrepo: Tuple[Path, List[GitRef]]):
     """Test the `closest_tag` method."""
     root, git_refs = git_testrepo
-    # main branch
-    assert (
-        await closest_tag(root, git_refs[2], [git_refs[0].obj, "1.0", "2.0"]) == "2.0"
-    )
-    # 1.0 tag should map to HEAD of dev branch
-    assert (
-        await closest_tag(root, git_refs[3], [git_refs[0].obj, "2.0"])
-        == git_refs[0].obj
-    )
-    # 1.0 tag should map to itself
-    assert (
-        await closest_tag(root, git_refs[3], [git_refs[0].obj, "1.0", "2.0"]) == "1.0"
-    )
-    # 2.0 tag should map to itself
-    assert (
-        await closest_tag(root, git_refs[4], [git_refs[0].obj, "1.0", "2.0"]) == "2.0"
+    dev_head = git_refs[0].obj
+    cases = [
+        # main branch
+        (git_refs[2], [dev_head, "1.0", "2.0"], "2.0"),
+        # 1.0 tag should map to HEAD of dev branch
+        (git_refs[3], [dev_head, "2.0"], dev_head),
+        # 1.0 tag should map to itself
+        (git_refs[3], [dev_head, "1.0", "2.0"], "1.0"),
+        # 2.0 tag should map to itself
+        (git_refs[4], [dev_head, "1.0", "2.0"], "2.0"),
+        # if their is no ancestor None should be returned
+        (git_refs[0], ["1.0", "2.0"], None),
+    ]
+
+    results = await asyncio.gather(
+        *(closest_tag(root, ref, tags) for ref, tags, _ in cases)
     )
-    # if their is no ancestor None should be returned
-    assert await closest_tag(root, git_refs[0], ["1.0", "2.0"]) is None
+    assert results == [expected for _, _, expected in cases]
+
+
+#: `(ref index, path, exists)` checked by `test_file_exists`
+FILE_EXISTS_CASES: Tuple[Tuple[int, str, bool], ...] = (
+    # dev branch
+    (0, "test.txt", True),
+    (0, "dir1", True),
+    (0, "dir2/file3.txt", True),
+    (0, "dir1/file2.txt", False),
+    # future branch
+    (1, "test.txt", True),
+    (1, "dir2", True),
+    (1, "dir1/file2.txt", True),
+    (1, "dir3", False),
+)
 
 
-@pytest.mark.asyncio
 async def test_file_exists(git_testrepo: Tuple[Path, List[GitRef]]):
     """Test the `file_exists` method."""
     root, git_refs = git_testrepo
 
-    # dev branch
-    assert await file_exists(root, git_refs[0], Path("test.txt"))
-    assert await file_exists(root, git_refs[0], Path("dir1"))
-    assert await file_exists(root, git_refs[0], Path("dir2/file3.txt"))
-    assert not await file_exists(root, git_refs[0], Path("dir1/file2.txt"))
-    # future branch
-    assert await file_exists(root, git_refs[1], Path("test.txt"))
-    assert await file_exists(root, git_refs[1], Path("dir2"))
-    assert await file_exists(root, git_refs[1], Path("dir1/file2.txt"))
-    assert not await file_exists(root, git_refs[1], Path("dir3"))
+    results = await asyncio.gather(
+        *(file_exists(root, git_refs[i], Path(p)) for i, p, _ in FILE_EXISTS_CASES)
+    )
+    assert results == [exists for _, _, exists in FILE_EXISTS_CASES]
 
 
-@pytest.mark.asyncio
 async def test_file_predicate(git_testrepo: Tuple[Path, List[GitRef]]):
     """Test the `file_exists` method."""
     root, git_refs = git_testrepo
     git = Git(
-        branch_regex=".*",
-        tag_regex=".*",
+        **_GIT_KW,
         predicate=file_predicate([Path("dir1/file2.txt"), Path("dir2")]),
     )
 
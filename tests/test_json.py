@@ -1,18 +1,39 @@
 """Test encoding and deconding of python types and objects to  the json format."""
 
 from datetime import datetime
+from pathlib import Path
+
+import pytest
 
 from sphinx_polyversion.git import GitRef, GitRefType
 from sphinx_polyversion.json import Decoder, Encoder, std_hook
 
 
-class TestEncoder:
-    """Unittests for the `Encoder` class."""
+@pytest.fixture(scope="class")
+def encoder() -> Encoder:
+    """Create an encoder with the standard hooks shared by a test class."""
+    return Encoder(std_hook)
 
-    def test_register_hook(self):
-        """Test that register() adds a hook to the encoder's hooks dictionary."""
-        encoder = Encoder()
 
+@pytest.fixture(scope="class")
+def decoder() -> Decoder:
+    """Create a decoder with the standard hooks and types shared by a test class."""
+    decoder = Decoder()
+    decoder.register(std_hook)
+    decoder.register(GitRef, GitRefType)
+    return decoder
+
+
+class TestEncoderRegister:
+    """Unittests for registering hooks with the `Encoder` class."""
+
+    @pytest.fixture
+    def encoder(self) -> Encoder:
+        """Create an encoder without any hooks for each test."""
+        return Encoder()
+
+    def test_register_hook(self, encoder: Encoder):
+        """Test that register() adds a hook to the encoder's hooks dictionary."""
         assert encoder.hooks == set()
 
         result = encoder.register(std_hook)
@@ -24,10 +45,8 @@ class TestEncoder:
 
         assert len(encoder.hooks) == 2
 
-    def test_register_type(self):
+    def test_register_type(self, encoder: Encoder):
         """Test that register() adds a type to the encoder's hooks dictionary."""
-        encoder = Encoder()
-
         assert encoder.hooks == set()
 
         result = encoder.register(GitRefType)
@@ -39,18 +58,18 @@ class TestEncoder:
 
         assert len(encoder.hooks) == 2
 
-    def test_determine_classname(self):
-        """Test that determine_classname() returns the expected class name for a given object."""
-        encoder = Encoder()
 
+class TestEncoder:
+    """Unittests for the `Encoder` class."""
+
+    def test_determine_classname(self, encoder: Encoder):
+        """Test that determine_classname() returns the expected class name for a given object."""
         assert (
             encoder.determine_classname(GitRef, instance=False)
             == "sphinx_polyversion.git.GitRef"
         )
         assert encoder.determine_classname(3) == ".int"
 
-        from pathlib import Path
-
         assert encoder.determine_classname(Path, instance=False) == "pathlib.Path"
 
         assert (
@@ -58,11 +77,8 @@ class TestEncoder:
         )
         assert encoder.determine_classname(datetime(2023, 1, 1)) == ".datetime"
 
-    def test_transform_hook(self):
+    def test_transform_hook(self, encoder: Encoder):
         """Test transforming hook."""
-        encoder = Encoder()
-        encoder.register(std_hook)
-
         assert encoder.transform(datetime(2023, 12, 2)) == {
             "__jsonhook__": (
                 "sphinx_polyversion.json.std_hook",
@@ -71,9 +87,8 @@ class TestEncoder:
             )
         }
 
-    def test_transform_class(self) -> None:
+    def test_transform_class(self, encoder: Encoder) -> None:
         """Test transforming the `Transformable` class.."""
-        encoder = Encoder()
         assert encoder.transform(GitRef("master", "3434", "", None, None)) == {
             "__jsonclass__": (
                 "sphinx_polyversion.git.GitRef",
@@ -81,9 +96,8 @@ class TestEncoder:
             )
         }
 
-    def test_transform_dict(self):
+    def test_transform_dict(self, encoder: Encoder):
         """Test that transform() returns the expected dictionary for a given dictionary with nested objects."""
-        encoder = Encoder()
         assert encoder.transform({"ref": GitRef("master", "3434", "", None, None)}) == {
             "ref": {
                 "__jsonclass__": (
@@ -93,9 +107,8 @@ class TestEncoder:
             }
         }
 
-    def test_transform_list(self):
+    def test_transform_list(self, encoder: Encoder):
         """Test that transform() returns the expected list for a given list with nested objects."""
-        encoder = Encoder()
         assert encoder.transform([GitRef("master", "3434", "", None, None)]) == [
             {
                 "__jsonclass__": (
@@ -105,20 +118,17 @@ class TestEncoder:
             }
         ]
 
-    def test_transform_any(self):
+    def test_transform_any(self, encoder: Encoder):
         """Test that transform() returns the input object for an unknown object."""
-        encoder = Encoder()
         o = object()
         assert encoder.transform(o) == o
 
-    def test_encode(self):
+    def test_encode(self, encoder: Encoder):
         """
         Test that encode() returns the expected JSON string for a given object.
 
         This uses dict, list, transformable, hook and some standard datatypes
         """
-        encoder = Encoder()
-        encoder.register(std_hook)
         obj = {
             "ref": GitRef(
                 "master",
@@ -137,43 +147,44 @@ class TestEncoder:
         )
 
 
-class TestDecoder:
-    """Unittests for the `Decoder` class."""
+class TestDecoderRegister:
+    """Unittests for registering hooks and types with the `Decoder` class."""
+
+    @pytest.fixture
+    def decoder(self) -> Decoder:
+        """Create a decoder without any hooks or types for each test."""
+        return Decoder()
 
-    def test_register_hook(self):
+    def test_register_hook(self, decoder: Decoder):
         """Test that register() adds a hook to the decoder's hooks dictionary."""
-        decoder = Decoder()
         decoder.register(std_hook)
         assert std_hook in decoder.hooks
 
-    def test_register_type(self):
+    def test_register_type(self, decoder: Decoder):
         """Test that register() adds a type to the decoder's registered_types dictionary."""
-        decoder = Decoder()
         decoder.register(GitRefType)
         assert GitRefType in decoder.registered_types
 
-    def test_register_from(self):
+    def test_register_from(self, decoder: Decoder):
         """Test that register_from() adds the same hooks and types to both the encoder and decoder."""
-        decoder_1 = Decoder()
-        decoder_1.register(GitRef, GitRefType)
-        assert decoder_1.registered_types == [GitRef, GitRefType]
+        decoder.register(GitRef, GitRefType)
+        assert decoder.registered_types == [GitRef, GitRefType]
 
         decoder_2 = Decoder()
-        decoder_2.register_from(decoder_1)
+        decoder_2.register_from(decoder)
         assert GitRef in decoder_2.registered_types
         assert GitRefType in decoder_2.registered_types
 
-    def test_determine_classname(self):
-        """Test that determine_classname() returns the expected class name for a given object."""
-        decoder = Decoder()
 
-        assert decoder.determine_classname(GitRef) == "sphinx_polyversion.git.GitRef"
-
-        from pathlib import Path
+class TestDecoder:
+    """Unittests for the `Decoder` class."""
 
+    def test_determine_classname(self, decoder: Decoder):
+        """Test that determine_classname() returns the expected class name for a given object."""
+        assert decoder.determine_classname(GitRef) == "sphinx_polyversion.git.GitRef"
         assert decoder.determine_classname(Path) == "pathlib.Path"
 
-    def test_decode(self):
+    def test_decode(self, decoder: Decoder):
         """Test that decode() returns the expected object for a given JSON string."""
         obj = {
             "ref": GitRef(
@@ -189,11 +200,26 @@ class TestDecoder:
         }
         encoded = '{"ref": {"__jsonclass__": ["sphinx_polyversion.git.GitRef", ["master", "3434", "refs/tags/v1.0.0", {"__jsonclass__": ["sphinx_polyversion.git.GitRefType", "TAG"]}, {"__jsonhook__": ["sphinx_polyversion.json.std_hook", ".datetime", "0200-02-06T06:03:06"]}, null]]}, "date": {"__jsonhook__": ["sphinx_polyversion.json.std_hook", ".datetime", "2023-12-02T00:00:00"]}, "list": [1, 2, 3], "dict": {"a": 1, "b": 2}}'
 
-        decoder = Decoder()
-        decoder.register(std_hook)
-        decoder.register(GitRef, GitRefType)
         assert decoder.decode(encoded) == obj
 
+    def test_roundtrip_large_nested(self, encoder: Encoder, decoder: Decoder):
+        """Test that many refs and a deeply nested dict survive a roundtrip."""
+        refs = [
+            GitRef(
+                f"v{i}",
+                f"{i:040x}",
+                f"refs/tags/v{i}",
+                GitRefType.TAG,
+                datetime(2023, 1, 1, i % 24),
+            )
+            for i in range(1000)
+        ]
+        nested: dict = {"refs": refs}
+        for i in range(100):
+            nested = {f"level{i}": nested, "date": datetime(2023, 12, 2)}
+
+        assert decoder.decode(encoder.encode(nested)) == nested
+
 
 class TestStd_Hook:
     """Ensure the hooks provided by this module work."""
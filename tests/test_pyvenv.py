@@ -1,7 +1,14 @@
 """Test the python environments in the `pyvenv` module."""
 
+from __future__ import annotations
+
 import asyncio
-from pathlib import Path
+import os
+import shutil
+from contextlib import AsyncExitStack
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, List
+from unittest import mock
 
 import pytest
 
@@ -13,31 +20,100 @@ from sphinx_polyversion.pyvenv import (
     VirtualPythonEnvironment,
 )
 
+if TYPE_CHECKING:
+    from pathlib import Path
+
+#: Skip tests needing the optional `virtualenv` package if it isn't installed
+requires_virtualenv = pytest.mark.skipif(
+    find_spec("virtualenv") is None, reason="virtualenv is not installed"
+)
+
+#: Script printing the value (or error name) of each expression passed as arg
+PROBE_SCRIPT = """
+import sys
+for expr in sys.argv[1:]:
+    try:
+        print(eval(expr))
+    except Exception as e:
+        print("!" + type(e).__name__)
+"""
+
+
+async def probe(env: VirtualPythonEnvironment, *exprs: str) -> List[str]:
+    """Evaluate python expressions in a single interpreter of the environment."""
+    out, err, rc = await env.run(
+        "python", "-c", PROBE_SCRIPT, *exprs, stdout=asyncio.subprocess.PIPE
+    )
+    assert rc == 0
+    return out.splitlines()
+
+
+@pytest.fixture(scope="session")
+def base_venv(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Create a venv with pip once per session."""
+    location = tmp_path_factory.mktemp("base_venv") / "venv"
+    VenvWrapper(with_pip=True).create(location)
+    return location
+
+
+@pytest.fixture
+def fresh_venv(base_venv: Path, tmp_path: Path) -> Path:
+    """Clone the session venv for a single test using hardlinks."""
+    location = tmp_path / "venv"
+    shutil.copytree(base_venv, location, symlinks=True, copy_function=os.link)
+
+    # the shebangs of the scripts (e.g. `pip`) point to the python of the
+    # original venv; replace (not edit) the files since they are hardlinks
+    old, new = os.fsencode(base_venv), os.fsencode(location)
+    for script in (location / "bin").iterdir():
+        if script.is_symlink() or not script.is_file():
+            continue
+        content = script.read_bytes()
+        if content.startswith(b"#!") and old in content:
+            mode = script.stat().st_mode
+            script.unlink()
+            script.write_bytes(content.replace(old, new))
+            script.chmod(mode)
+    return location
+
 
-@pytest.mark.asyncio
 async def test_venv_creation(tmp_path: Path):
     """Test the creation of a python virtual environment."""
     location = tmp_path / "venv"
-    await VenvWrapper()(location)
+    await VenvWrapper(with_pip=False)(location)
     assert location.exists()
     assert (location / "bin" / "python").exists()
 
 
-@pytest.mark.asyncio
+@requires_virtualenv
 async def test_virtualvenv_creation(tmp_path: Path):
     """Test the creation of a python virtual environment."""
-    pytest.importorskip("virtualenv")
-
     location = tmp_path / "venv"
-    await VirtualenvWrapper([])(location)
+    await VirtualenvWrapper(["--no-seed"])(location)
     assert location.exists()
     assert (location / "bin" / "python").exists()
 
 
+async def test_venv_wrapper_calls_create(tmp_path: Path):
+    """Test that `VenvWrapper` delegates to `EnvBuilder.create`."""
+    location = tmp_path / "venv"
+    with mock.patch.object(VenvWrapper, "create") as create:
+        await VenvWrapper()(location)
+    create.assert_called_once_with(location)
+
+
+@requires_virtualenv
+async def test_virtualenv_wrapper_passes_args(tmp_path: Path):
+    """Test that `VirtualenvWrapper` passes its args to `virtualenv`."""
+    location = tmp_path / "venv"
+    with mock.patch("virtualenv.cli_run") as cli_run:
+        await VirtualenvWrapper(["--no-seed"])(location)
+    cli_run.assert_called_once_with(["--no-seed", str(location)])
+
+
 class TestVirtualPythonEnvionment:
     """Test the `VirtualPythonEnvironment` class."""
 
-    @pytest.mark.asyncio
     async def test_creation_with_venv(self, tmp_path: Path):
         """Test the `create_venv` method with a `VenvWrapper`."""
         location = tmp_path / "venv"
@@ -48,7 +124,6 @@ class TestVirtualPythonEnvionment:
         await env.create_venv()
         assert (location / "bin" / "python").exists()
 
-    @pytest.mark.asyncio
     async def test_creation_without_creator(self, tmp_path: Path):
         """Test the `create_venv` method without any creator."""
         location = tmp_path / "venv"
@@ -57,7 +132,6 @@ class TestVirtualPythonEnvionment:
         await env.create_venv()
         assert not (location / "bin" / "python").exists()
 
-    @pytest.mark.asyncio
     async def test_run_without_creator_no_existing(self, tmp_path: Path):
         """Test running a command without an existing venv and without creator."""
         location = tmp_path / "novenv"
@@ -71,13 +145,9 @@ class TestVirtualPythonEnvionment:
                     stdout=asyncio.subprocess.PIPE,
                 )
 
-    @pytest.mark.asyncio
-    async def test_run_without_creator(self, tmp_path: Path):
+    async def test_run_without_creator(self, tmp_path: Path, fresh_venv: Path):
         """Test running a command in an existing venv."""
-        location = tmp_path / "venv"
-
-        # create env
-        await VenvWrapper([])(location)
+        location = fresh_venv
 
         async with VirtualPythonEnvironment(tmp_path, "main", location) as env:
             out, err, rc = await env.run(
@@ -89,7 +159,6 @@ class TestVirtualPythonEnvionment:
             assert rc == 0
             assert str(location) == out.strip()
 
-    @pytest.mark.asyncio
     async def test_run_with_creator(self, tmp_path: Path):
         """Test running a command in a new venv."""
         location = tmp_path / "venv"
@@ -110,23 +179,12 @@ class TestVirtualPythonEnvionment:
 class TestPip:
     """Test the `Pip` class."""
 
-    @pytest.mark.asyncio
-    async def test_install_into_existing_venv(self, tmp_path: Path):
+    async def test_install_into_existing_venv(self, tmp_path: Path, fresh_venv: Path):
         """Test installing a package into an existing venv."""
-        location = tmp_path / "venv"
-
-        # create env
-        await VenvWrapper(with_pip=True)(location)
+        location = fresh_venv
 
-        # test that tomli is not installed
-        proc = await asyncio.create_subprocess_exec(
-            str(location / "bin/python"),
-            "-c",
-            "import tomli",
-            stdout=asyncio.subprocess.PIPE,
-        )
-        rc = await proc.wait()
-        assert rc == 1
+        # test that tomli is not installed (the venv is isolated from the system)
+        assert not any((location / "lib").glob("python*/site-packages/tomli*"))
 
         # init env with tomli
         async with Pip(tmp_path, "main", location, args=["tomli"]) as env:
@@ -143,7 +201,6 @@ class TestPip:
 class TestPoetry:
     """Test the `Poetry` environment."""
 
-    @pytest.mark.asyncio
     async def test_simple_project(self, tmp_path: Path):
         """Test installing a simple project with poetry."""
         # create source files
@@ -164,41 +221,25 @@ class TestPoetry:
 
             [tool.poetry.dependencies]
             python = "^3.8"
-            tomli = "*"
+            tomli = "2.0.1"
             """
         )
 
         # create poetry env
         async with Poetry(tmp_path, "main", args=[]) as env:
-            # check sourcing works
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import sys; print(sys.prefix)",
-                stdout=asyncio.subprocess.PIPE,
+            prefix, project, tomli = await probe(
+                env,
+                "sys.prefix",
+                "__import__('test').__name__",
+                "__import__('tomli').__name__",
             )
-            assert rc == 0
-            assert str(tmp_path) in out.strip()
-
+            # check sourcing works
+            assert str(tmp_path) in prefix
             # test that project is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import test",
-                stdout=asyncio.subprocess.PIPE,
-            )
-            assert rc == 0
-
+            assert project == "test"
             # test that tomli is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import tomli",
-                stdout=asyncio.subprocess.PIPE,
-            )
-            assert rc == 0
+            assert tomli == "tomli"
 
-    @pytest.mark.asyncio
     async def test_simple_project_with_optional_deps(self, tmp_path: Path):
         """Test installing a simple project with poetry."""
         # create source files
@@ -224,71 +265,65 @@ class TestPoetry:
             optional = true
 
             [tool.poetry.group.dev.dependencies]
-            tomli = "*"
+            tomli = "2.0.1"
             """
         )
 
         # create poetry env
         async with Poetry(tmp_path, "main", args=[]) as env:
-            # check sourcing works
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import sys; print(sys.prefix)",
-                stdout=asyncio.subprocess.PIPE,
+            prefix, project, tomli = await probe(
+                env,
+                "sys.prefix",
+                "__import__('test').__name__",
+                "__import__('tomli').__name__",
             )
-            assert rc == 0
-            assert str(tmp_path) in out.strip()
-
+            # check sourcing works
+            assert str(tmp_path) in prefix
             # test that project is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import test",
-                stdout=asyncio.subprocess.PIPE,
-            )
-            assert rc == 0
-
+            assert project == "test"
             # test that tomli is not installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import tomli",
-                stdout=asyncio.subprocess.PIPE,
-            )
-            assert rc == 1
+            assert tomli == "!ModuleNotFoundError"
 
         # create poetry env
         async with Poetry(tmp_path, "main", args=["--with=dev"]) as env:
-            # check sourcing works
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import sys; print(sys.prefix)",
-                stdout=asyncio.subprocess.PIPE,
+            prefix, project, tomli = await probe(
+                env,
+                "sys.prefix",
+                "__import__('test').__name__",
+                "__import__('tomli').__name__",
             )
-            assert rc == 0
-            assert str(tmp_path) in out.strip()
-
+            # check sourcing works
+            assert str(tmp_path) in prefix
             # test that project is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import test",
-                stdout=asyncio.subprocess.PIPE,
-            )
-            assert rc == 0
-
+            assert project == "test"
             # test that tomli is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import tomli",
-                stdout=asyncio.subprocess.PIPE,
+            assert tomli == "tomli"
+
+    async def test_concurrent_enter_separate_venv_dirs(self, tmp_path: Path):
+        """Test that concurrently entered environments get their own venv dir."""
+        venv_paths = []
+
+        async def create_subprocess_exec(*cmd: str, env: dict, **kwargs):
+            path = env["POETRY_VIRTUALENVS_PATH"]
+            if cmd[1] == "install":
+                venv_paths.append(path)
+            process = mock.Mock(returncode=0)
+            process.communicate = mock.AsyncMock(return_value=(path.encode(), b""))
+            return process
+
+        with mock.patch(
+            "sphinx_polyversion.pyvenv.asyncio.create_subprocess_exec",
+            create_subprocess_exec,
+        ):
+            env, env2 = await asyncio.gather(
+                Poetry(tmp_path, "main", args=[]).__aenter__(),
+                Poetry(tmp_path, "main", args=["--with=dev"]).__aenter__(),
             )
-            assert rc == 0
 
-    @pytest.mark.asyncio
+        assert len(venv_paths) == 2
+        assert venv_paths[0] != venv_paths[1]
+        assert env.venv != env2.venv
+
     async def test_create_two_concurrently(self, tmp_path: Path):
         """Test creating two environments concurrently."""
         # create source files
@@ -314,78 +349,55 @@ class TestPoetry:
             optional = true
 
             [tool.poetry.group.dev.dependencies]
-            tomli = "*"
+            tomli = "2.0.1"
             """
         )
 
-        # create poetry env
-        async with Poetry(tmp_path, "main", args=[]) as env:
-            # check sourcing works
-            first_path, err, rc = await env.run(
-                "python",
-                "-c",
-                "import sys; print(sys.prefix)",
-                stdout=asyncio.subprocess.PIPE,
+        # lock the dependencies first so that only the installs overlap,
+        # otherwise both of them would write `poetry.lock` concurrently
+        process = await asyncio.create_subprocess_exec(
+            "poetry",
+            "lock",
+            cwd=tmp_path,
+            env={**os.environ, "POETRY_VIRTUALENVS_CREATE": "false"},
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, err = await process.communicate()
+        assert process.returncode == 0, err.decode(errors="ignore")
+
+        # create both poetry envs at the same time
+        poetry = Poetry(tmp_path, "main", args=[])
+        poetry_dev = Poetry(tmp_path, "main", args=["--with=dev"])
+        async with AsyncExitStack() as stack:
+            # wait for both to finish entering and exit the entered ones
+            # even if entering the other one failed
+            results = await asyncio.gather(
+                poetry.__aenter__(), poetry_dev.__aenter__(), return_exceptions=True
             )
-            first_path = first_path.strip()
-            assert rc == 0
-            assert str(tmp_path) in first_path
-
-            # test that project is installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import test",
-                stdout=asyncio.subprocess.PIPE,
+            for poetry_env, result in zip((poetry, poetry_dev), results):
+                if not isinstance(result, BaseException):
+                    stack.push_async_exit(poetry_env)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            env, env2 = results
+
+            exprs = (
+                "sys.prefix",
+                "__import__('test').__name__",
+                "__import__('tomli').__name__",
             )
-            assert rc == 0
-
-            # test that tomli is not installed
-            out, err, rc = await env.run(
-                "python",
-                "-c",
-                "import tomli",
-                stdout=asyncio.subprocess.PIPE,
+            first, second = await asyncio.gather(
+                probe(env, *exprs), probe(env2, *exprs)
             )
-            assert rc == 1
-
-            # create second poetry env
-            async with Poetry(tmp_path, "main", args=["--with=dev"]) as env2:
-                # check sourcing works
-                out, err, rc = await env2.run(
-                    "python",
-                    "-c",
-                    "import sys; print(sys.prefix)",
-                    stdout=asyncio.subprocess.PIPE,
-                )
-                assert rc == 0
-                assert str(tmp_path) in out.strip()
-                assert out.strip() != first_path
-
-                # check that old env still works
-                out, err, rc = await env.run(
-                    "python",
-                    "-c",
-                    "import sys; print(sys.prefix)",
-                    stdout=asyncio.subprocess.PIPE,
-                )
-                assert rc == 0
-                assert first_path == out.strip()
-
-                # test that project is installed
-                out, err, rc = await env2.run(
-                    "python",
-                    "-c",
-                    "import test",
-                    stdout=asyncio.subprocess.PIPE,
-                )
-                assert rc == 0
-
-                # test that tomli is installed
-                out, err, rc = await env2.run(
-                    "python",
-                    "-c",
-                    "import tomli",
-                    stdout=asyncio.subprocess.PIPE,
-                )
-                assert rc == 0
+            first_path, project, tomli = first
+            second_path, project2, tomli2 = second
+            # check sourcing works and the envs are separate
+            assert str(tmp_path) in first_path
+            assert str(tmp_path) in second_path
+            assert first_path != second_path
+            # test that project is installed in both
+            assert project == project2 == "test"
+            # test that tomli is only installed with the dev group
+            assert tomli == "!ModuleNotFoundError"
+            assert tomli2 == "tomli"
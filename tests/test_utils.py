@@ -8,54 +8,73 @@ import pytest
 
 from sphinx_polyversion.utils import async_all, import_file, shift_path
 
-
-@pytest.mark.parametrize(
-    ("anchor1", "anchor2", "path", "solution"),
-    [
+#: `(anchor1, anchor2, path, solution)` rows for `test_shift_path`
+SHIFT_PATH_CASES = tuple(
+    tuple(map(PurePath, row))
+    for row in (
         ("a", "b", "a/c", "b/c"),
         ("a", "b", "a/b/c", "b/b/c"),
         ("a/b", "a", "a/b/c", "a/c"),
         ("a/b", "b", "a/b/c/d", "b/c/d"),
-    ],
+    )
+)
+
+
+@pytest.mark.parametrize(
+    ("anchor1", "anchor2", "path", "solution"),
+    SHIFT_PATH_CASES,
+    ids=[f"{a1}->{a2}:{p}" for a1, a2, p, _ in SHIFT_PATH_CASES],
 )
 def test_shift_path(anchor1, anchor2, path, solution):
     """Test the shift_path function."""
-    assert shift_path(PurePath(anchor1), PurePath(anchor2), PurePath(path)) == PurePath(
-        solution
-    )
+    assert shift_path(anchor1, anchor2, path) == solution
 
 
 T = TypeVar("T")
 
 
-def test_async_all():
-    """Test the `async_all` implementation."""
+def ready(value: T) -> "asyncio.Future[T]":
+    """Return a future of the running loop that is already resolved with `value`."""
+    fut = asyncio.get_running_loop().create_future()
+    fut.set_result(value)
+    return fut
 
-    async def future(value: T) -> T:
-        return value
 
-    assert asyncio.run(async_all([]))
+#: `(id, awaited values, expected result)` rows for `test_async_all`
+ASYNC_ALL_CASES = (
+    ("empty", (), True),
+    ("all_true", (True,) * 8, True),
+    ("all_false", (False,) * 8, False),
+    ("first_false", (False,) + (True,) * 8, False),
+    ("last_false", (True,) * 8 + (False,), False),
+    ("some_false", ((True,) * 5 + (False,)) * 2 + (True,) * 5, False),
+)
 
-    all_true = [future(True) for i in range(8)]
-    assert asyncio.run(async_all(all_true))
 
-    all_false = [future(False) for i in range(8)]
-    assert not asyncio.run(async_all(all_false))
+@pytest.mark.parametrize(
+    ("values", "expected"),
+    [case[1:] for case in ASYNC_ALL_CASES],
+    ids=[case[0] for case in ASYNC_ALL_CASES],
+)
+async def test_async_all(values, expected):
+    """Test the `async_all` implementation."""
+    assert await async_all([ready(v) for v in values]) is expected
 
-    first_false = [future(False)] + [future(True) for i in range(8)]
-    assert not asyncio.run(async_all(first_false))
 
-    last_false = [future(True) for i in range(8)] + [future(False)]
-    assert not asyncio.run(async_all(last_false))
+async def test_async_all_cancels_pending():
+    """Test that `async_all` returns early and cancels the rest once one is falsy."""
+    completed = []
 
-    some_false = (
-        [future(True) for i in range(5)]
-        + [future(False)]
-        + [future(True) for i in range(5)]
-        + [future(False)]
-        + [future(True) for i in range(5)]
-    )
-    assert not asyncio.run(async_all(some_false))
+    async def slow(value: T) -> T:
+        await asyncio.sleep(60)
+        completed.append(value)
+        return value
+
+    hanging = [asyncio.ensure_future(asyncio.sleep(60, True)) for _ in range(50)]
+    awaitables = [ready(False), *hanging, *(slow(True) for _ in range(50))]
+    assert not await asyncio.wait_for(async_all(awaitables), timeout=5)
+    assert all(fut.cancelled() for fut in hanging)
+    assert completed == []
 
 
 def test_import_file(tmp_path: Path):